@@ -0,0 +1,138 @@
+"""
+Benchmarks da engine.
+
+    Por padrão, mede a escalabilidade do cálculo paralelo da gravidade sobre as partículas traçadoras:
+    o tempo de `gravity_field` (serial) e dos backends do módulo parallel com 1 até todos os núcleos,
+    conferindo que todos dão exatamente o mesmo resultado que o cálculo serial. Uso:
+
+        python bench.py --n 1000000 --fontes 4 --repeticoes 5
+
+    Com --precisao, mede o erro de arredondamento do velocity-verlet da engine, com e sem o modo de alta
+    precisão, comparando com o mesmo integrador em precisão estendida (np.longdouble, 80 bits em x86;
+    em plataformas onde ele é igual ao float64 a comparação não tem sentido). Uso:
+
+        python bench.py --precisao --passos 200000
+"""
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+from engine import Engine, Object, G, gravity_field
+from parallel import make_backend
+
+def measure(field, x, sources_x, sources_mass, out, repetitions):
+    """
+    Retorna o melhor tempo, em segundos, de `repetitions` chamadas de `field`.
+    """
+    field(x, sources_x, sources_mass, 0.0, out=out) # aquecimento (cria threads/processos, memória compartilhada)
+
+    best = np.inf
+    for i in range(repetitions):
+        start = time.perf_counter()
+        field(x, sources_x, sources_mass, 0.0, out=out)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def reference_verlet(x, v, center, mass, dt, n_steps):
+    """
+    O mesmo velocity-verlet de `Engine.verlet_step`, em precisão estendida, como referência sem arredondamento
+    significativo.
+    """
+    L = np.longdouble
+    x, v, center = np.array(x, L), np.array(v, L), np.array(center, L)
+    mu, dt = L(G) * L(mass), L(dt)
+
+    r = x - center
+    a = -mu * r / np.sqrt(r @ r) ** 3
+    for i in range(n_steps):
+        v = v + a * dt / 2
+        x = x + v * dt
+        r = x - center
+        a = -mu * r / np.sqrt(r @ r) ** 3
+        v = v + a * dt / 2
+
+    return x
+
+def precision_benchmark(n_steps):
+    """
+    Erro de posição acumulado só pelo arredondamento (diferença para `reference_verlet`) após `n_steps`
+    passos de tamanho DELTA, com a estrela na origem e longe dela.
+    """
+    import pygame
+
+    # A engine precisa de uma superfície e de uma fonte, mesmo sem desenhar nada
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    surface = pygame.display.set_mode((1, 1))
+    font = pygame.font.Font(None, 12)
+
+    for offset in (0.0, 1e4, 1e6):
+        center = np.array([offset, offset])
+        x0 = center + [110.0, 100.0]
+        v0 = np.array([100.0, -90.0])
+
+        expected = reference_verlet(x0, v0, center, 5e16, Engine.DELTA, n_steps).astype(float)
+
+        for high_precision in (False, True):
+            engine = Engine(surface, font)
+            engine.high_precision = high_precision
+
+            star = Object(5e16, 12, trail=False)
+            planet = Object(100, 5, trail=False)
+            np.copyto(star.x, center)
+            np.copyto(planet.x, x0)
+            np.copyto(planet.v, v0)
+            planet.set_attractor(star)
+            np.copyto(planet.a, engine.acceleration(planet, planet.x))
+
+            start = time.perf_counter()
+            for i in range(n_steps):
+                engine.verlet_step(planet, Engine.DELTA)
+            elapsed = time.perf_counter() - start
+
+            mode = 'alta precisão' if high_precision else 'normal'
+            print(f"deslocamento {offset:8.0e}  {mode:>13}  erro {np.linalg.norm(planet.x - expected):.2e}  {elapsed:6.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks dos backends de força paralelos e do modo de alta precisão")
+    parser.add_argument('--n', type=int, default=1_000_000, help="número de partículas traçadoras (padrão: 1000000)")
+    parser.add_argument('--fontes', type=int, default=4, help="número de corpos massivos (padrão: 4)")
+    parser.add_argument('--repeticoes', type=int, default=5, help="repetições por medida (padrão: 5)")
+    parser.add_argument('--precisao', action='store_true', help="mede o erro de arredondamento com e sem --alta-precisao, ao invés da escalabilidade")
+    parser.add_argument('--passos', type=int, default=200_000, help="passos de integração do benchmark de precisão (padrão: 200000)")
+    args = parser.parse_args()
+
+    if args.precisao:
+        precision_benchmark(args.passos)
+        return
+
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1000, 1000, (args.n, 2))
+    sources_x = rng.uniform(-100, 100, (args.fontes, 2))
+    sources_mass = rng.uniform(1e15, 1e16, args.fontes)
+
+    expected = np.empty_like(x)
+    serial = measure(gravity_field, x, sources_x, sources_mass, expected, args.repeticoes)
+    print(f"{'serial':>10} {'':>8} {serial * 1e3:10.2f} ms")
+
+    cores = os.cpu_count()
+    counts = sorted({1, cores} | {2 ** k for k in range(1, cores.bit_length()) if 2 ** k < cores})
+
+    for kind in ('threads', 'processos'):
+        for workers in counts:
+            backend = make_backend(kind, workers)
+            out = np.empty_like(x)
+            try:
+                elapsed = measure(backend, x, sources_x, sources_mass, out, args.repeticoes)
+            finally:
+                backend.close()
+
+            identical = 'idêntico' if np.array_equal(out, expected) else 'DIFERENTE'
+            print(f"{kind:>10} {workers:>8} {elapsed * 1e3:10.2f} ms  speedup {serial / elapsed:5.2f}x  {identical}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Cache de trajetórias: guarda os estados já integrados de uma simulação para que, ao repetir a mesma
+configuração (ex.: após um reset), os frames sejam reproduzidos sem integrar tudo de novo.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+from collections import OrderedDict
+
+class TrajectoryCache:
+    """
+    Cache em memória, com descarte do item usado há mais tempo (LRU), das trajetórias já simuladas.
+
+    Cada trajetória é um array de formato (frames, objetos, 3, 2) com a posição, velocidade e aceleração
+    de cada objeto ao final de cada frame, identificado por uma chave gerada a partir da configuração
+    inicial e dos parâmetros do integrador. Se `directory` for dado, as trajetórias descartadas da memória
+    (e todas as restantes, em `flush`) são gravadas em disco e podem ser recarregadas depois. Cada arquivo
+    é escrito por inteiro antes de substituir o anterior, e arquivos ilegíveis (ex.: de versões antigas
+    interrompidas no meio da gravação) são tratados como ausentes e apagados.
+
+    Atributos:
+    - max_entries (int): Número máximo de trajetórias na memória.
+    - directory (str): Diretório do armazenamento em disco (None para apenas memória).
+    - entries (OrderedDict): Trajetórias em memória, da usada há mais tempo para a mais recente.
+    """
+    # Algarismos significativos considerados na chave: configurações quase iguais dão a mesma chave
+    KEY_DIGITS = 9
+
+    def __init__(self, max_entries: int = 8, directory: str = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries: OrderedDict[str, np.ndarray] = OrderedDict()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def make_key(cls, config: dict, settings: dict) -> str:
+        """
+        Gera a chave de uma trajetória a partir da configuração inicial e dos parâmetros do integrador.
+
+        Parâmetros:
+            config (dicionário): Configuração da simulação (ex.: a retornada pela Sandbox).
+            settings (dicionário): Parâmetros do integrador (ver Engine.integrator_settings).
+
+        Retorno:
+            str: Hash hexadecimal da configuração.
+        """
+        def normalize(value):
+            if isinstance(value, dict):
+                return {k: normalize(v) for k, v in sorted(value.items())}
+            if isinstance(value, (list, tuple, np.ndarray)):
+                return [normalize(v) for v in value]
+            if isinstance(value, (float, np.floating)):
+                return float(f"{value:.{cls.KEY_DIGITS}g}")
+            return value
+
+        data = json.dumps(normalize({'config': config, 'settings': settings}), sort_keys=True)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def load(self, key: str, mmap_mode: str = None) -> np.ndarray:
+        """
+        Lê a trajetória `key` do disco, ou retorna None se ela não existir ou o arquivo estiver corrompido
+        (caso em que ele é apagado, para ser gravado de novo).
+        """
+        if not self.directory or not os.path.exists(self.path(key)):
+            return None
+
+        try:
+            return np.load(self.path(key), mmap_mode=mmap_mode)
+        except (OSError, ValueError, EOFError):
+            os.remove(self.path(key))
+            return None
+
+    def stored_length(self, key: str) -> int:
+        """
+        Número de frames já guardados com a chave `key`, na memória ou no disco (0 se nenhum), sem carregar
+        a trajetória nem mexer na ordem do LRU.
+        """
+        if key in self.entries:
+            return len(self.entries[key])
+
+        frames = self.load(key, mmap_mode='r')
+        return 0 if frames is None else len(frames)
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        Retorna a trajetória com a chave `key`, procurando na memória e depois no disco, ou None se não existir.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        frames = self.load(key)
+        if frames is not None:
+            self.insert(key, frames)
+
+        return frames
+
+    def put(self, key: str, frames: np.ndarray):
+        """
+        Guarda a trajetória `frames` com a chave `key`, a menos que já exista uma trajetória mais longa com ela.
+        """
+        if self.stored_length(key) >= len(frames):
+            return
+
+        self.insert(key, frames)
+
+    def insert(self, key: str, frames: np.ndarray):
+        self.entries[key] = frames
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            old_key, old_frames = self.entries.popitem(last=False)
+            self.spill(old_key, old_frames)
+
+    def spill(self, key: str, frames: np.ndarray):
+        """
+        Grava a trajetória em disco, se houver diretório e a versão em disco for mais curta.
+
+        O arquivo é escrito em um temporário no mesmo diretório e só então renomeado, de forma que um
+        processo interrompido no meio da gravação não deixa um arquivo truncado no lugar da trajetória.
+        """
+        if not self.directory:
+            return
+
+        stored = self.load(key, mmap_mode='r')
+        if stored is not None and len(stored) >= len(frames):
+            return
+        del stored  # fecha o mapeamento antes de substituir o arquivo
+
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                np.save(file, frames)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def flush(self):
+        """
+        Grava em disco todas as trajetórias da memória (ex.: ao fechar o programa).
+        """
+        for key, frames in self.entries.items():
+            self.spill(key, frames)
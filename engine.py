@@ -14,11 +14,120 @@ Nome do Projeto: Simulador de gravitacao Newtoniana
     Este projeto faz parte do processo avaliativo da disciplina 7600105 - Física Básica I (2024) da USP-São Carlos ministrada pela(o) [Prof. Krissia de Zawadzki/Esmerindo de Sousa Bernardes]
 """
 
+import cmath
 import pygame
 import numpy as np
 
+from collections import OrderedDict
 from typing import Callable
 
+from cache import TrajectoryCache
+
+G = 6.6 * 10 ** -11
+
+def stumpff(y: float) -> tuple[float, float, float, float]:
+    """
+    Calcula as funções de Stumpff c0, c1, c2 e c3 no argumento y. Elas permitem escrever
+    as soluções do oscilador harmônico (y > 0), da sua versão hiperbólica (y < 0) e do caso
+    livre (y = 0) com uma única fórmula, sem perda de precisão perto de y = 0.
+    Entrada:
+        y(float)-> argumento das funções
+    Saída:
+        tupla com (c0, c1, c2, c3)
+    """
+    if abs(y) < 0.1:
+        # Perto de zero as fórmulas fechadas sofrem cancelamento, então usamos a série de Taylor
+        c = [0.0] * 4
+        for k in range(4):
+            term = 1.0
+            for i in range(2, k + 1):
+                term /= i
+            total = term
+            for n in range(1, 8):
+                term *= -y / ((2 * n + k - 1) * (2 * n + k))
+                total += term
+            c[k] = total
+        return tuple(c)
+
+    if y > 0:
+        sq = np.sqrt(y)
+        return np.cos(sq), np.sin(sq) / sq, (1 - np.cos(sq)) / y, (sq - np.sin(sq)) / (y * sq)
+
+    sq = np.sqrt(-y)
+    return np.cosh(sq), np.sinh(sq) / sq, (np.cosh(sq) - 1) / -y, (np.sinh(sq) - sq) / (-y * sq)
+
+def kepler_drift(x: np.array, v: np.array, mu: float, dt: float) -> tuple[np.array, np.array]:
+    """
+    Avança exatamente o problema de dois corpos (aceleração -mu * r / |r|^3) por um tempo dt
+    usando a regularização de Levi-Civita. Com z = x + iy = u^2 e o tempo fictício s (dt = r ds),
+    a equação de movimento vira u'' = (h/2) u, um oscilador harmônico com solução fechada, mesmo
+    quando o corpo passa rente (ou através) do atrator. Depois procuramos, pelo método de Newton,
+    o s que corresponde ao tempo físico dt.
+    Entradas:
+        x(array)-> posição relativa ao atrator
+        v(array)-> velocidade relativa ao atrator
+        mu(float)-> parâmetro gravitacional G * M do atrator
+        dt(float)-> intervalo de tempo físico
+    Saída:
+        tupla com a nova posição e a nova velocidade relativas ao atrator
+    Exceções:
+        ValueError: se o corpo estiver exatamente sobre o atrator (r = 0), onde a velocidade
+        regularizada não é definida
+    """
+    z = complex(*x)
+    w = complex(*v)
+
+    u = cmath.sqrt(z)
+    r = abs(z)
+    if r == 0:
+        raise ValueError("kepler_drift não é definido com o corpo exatamente sobre o atrator (r = 0)")
+    du = u.conjugate() * w / 2 # du/ds
+
+    h = abs(w) ** 2 / 2 - mu / r # energia por unidade de massa, constante no movimento
+    beta = -h / 2
+
+    cross = 2 * (u * du.conjugate()).real
+
+    def evolve(s):
+        """Retorna u(s), u'(s) e o tempo físico t(s) = integral de |u|^2 ds."""
+        c0, c1, _, _ = stumpff(beta * s * s)
+        _, d1, d2, d3 = stumpff(4 * beta * s * s)
+
+        C, S = c0, s * c1
+        u_s = u * C + du * S
+        du_s = -beta * S * u + C * du
+        t = abs(u) ** 2 * s * (1 + d1) / 2 + abs(du) ** 2 * 2 * s ** 3 * d3 + cross * s * s * d2
+
+        return u_s, du_s, t
+
+    # Newton com salvaguarda de bisseção: t(s) é crescente, pois dt/ds = r >= 0
+    s = dt / r
+    lo, hi = 0.0, None
+    for _ in range(100):
+        u_s, _, t = evolve(s)
+
+        if t < dt:
+            lo = s
+        else:
+            hi = s
+
+        new_s = s - (t - dt) / max(abs(u_s) ** 2, 1e-300)
+        if new_s <= lo or (hi is not None and new_s >= hi):
+            new_s = (lo + hi) / 2 if hi is not None else 2 * s
+
+        if abs(new_s - s) <= 1e-15 * abs(s):
+            s = new_s
+            break
+
+        s = new_s
+
+    u_s, du_s, _ = evolve(s)
+
+    z_s = u_s * u_s
+    w_s = 2 * du_s / u_s.conjugate()
+
+    return np.array([z_s.real, z_s.imag]), np.array([w_s.real, w_s.imag])
+
 class Object:
     """
     Classe que representa a estrela e o planeta estarão formando o sistema de órbita. 
@@ -35,6 +144,7 @@ class Object:
            trail(bool)-> rastro,
            forces(list)-> lista de forças que atuam(inicializado com um array de funções),
            x,v,a(array) -> são respectivamente posição, velocidade e aceleração do corpo. São inicializados com um array de tamanho 2.Com todas as posições sendo 0.
+           x_error,v_error(array) -> erros de arredondamento da posição e da velocidade, usados pela soma compensada no modo de alta precisão
         """
         self.mass = mass
         self.radius = radius
@@ -42,12 +152,22 @@ class Object:
 
         self.forces: list[Callable] = []
 
-        self.x = np.array([0] * 2)
-        self.v = np.array([0] * 2)
-        self.a = np.array([0] * 2)
+        # float64 desde o início, para que as contas não criem cópias promovendo o tipo de int para float
+        self.x = np.zeros(2)
+        self.v = np.zeros(2)
+        self.a = np.zeros(2)
+
+        self.x_error = np.zeros(2)
+        self.v_error = np.zeros(2)
 
         self.rect: pygame.Rect = None
 
+        # Corpo que atrai gravitacionalmente este objeto. A força dele é calculada pela Engine
+        self.attractor: Object = None
+
+        # Nível do passo de tempo em blocos (o passo é o tempo de um frame dividido por 2^level)
+        self.level: int = None
+
     def add_force(self, force: Callable):
         """
         Método de adiciona forças ao vetor de forças do objeto
@@ -56,6 +176,139 @@ class Object:
         """
         self.forces.append(force)
 
+    def set_attractor(self, attractor: 'Object'):
+        """
+        Define o corpo que atrai gravitacionalmente este objeto (ex.: a estrela para o planeta).
+        Diferente das forças em `forces`, a gravidade do atrator é conhecida pela Engine, o que 
+        permite suavizá-la e regularizar os encontros próximos.
+        Entrada:
+            attractor(Object)-> corpo atrator
+        """
+        self.attractor = attractor
+
+def kahan_add(total: np.ndarray, compensation: np.ndarray, increment: np.ndarray, scratch: np.ndarray):
+    """
+    Soma compensada de Kahan, feita no lugar: total += increment, guardando em `compensation` a parte do
+    incremento perdida no arredondamento, que é devolvida na próxima soma. Assim, somar milhões de incrementos
+    pequenos a coordenadas grandes não acumula erro de arredondamento. Não aloca memória.
+    Entradas:
+        total(array)-> valor acumulado (alterado no lugar)
+        compensation(array)-> erro de arredondamento acumulado (alterado no lugar)
+        increment(array)-> incremento
+        scratch(array)-> área de trabalho de formato (2, *total.shape)
+    """
+    y, t = scratch
+    np.subtract(increment, compensation, out=y)
+    np.add(total, y, out=t)
+    np.subtract(t, total, out=compensation)
+    np.subtract(compensation, y, out=compensation)
+    np.copyto(total, t)
+
+def gravity_field(x: np.ndarray, sources_x: np.ndarray, sources_mass: np.ndarray, softening: float, out: np.ndarray = None) -> np.ndarray:
+    """
+    Calcula, de uma vez para todos os pontos, a aceleração gravitacional dos corpos massivos. O custo é
+    O(corpos massivos x pontos): o laço em Python percorre só os poucos corpos massivos e as operações
+    sobre os pontos são vetorizadas pelo NumPy.
+    Entradas:
+        x(array)-> posições dos pontos, formato (N, 2)
+        sources_x(array)-> posições dos corpos massivos, formato (M, 2)
+        sources_mass(array)-> massas dos corpos massivos, formato (M,)
+        softening(float)-> comprimento de suavização de Plummer
+        out(array)-> array de formato (N, 2) onde o resultado é escrito (opcional)
+    Saída:
+        array-> acelerações, formato (N, 2)
+    """
+    if out is None:
+        out = np.empty_like(x)
+    out[:] = 0
+
+    for source_x, mass in zip(sources_x, sources_mass):
+        r = x - source_x
+        d2 = np.einsum('ij,ij->i', r, r) + softening ** 2
+        out -= (G * mass / (d2 * np.sqrt(d2)))[:, None] * r
+
+    return out
+
+class Tracers:
+    """
+    Conjunto de partículas traçadoras sem massa: sentem a gravidade dos corpos massivos da Engine, mas não
+    exercem força em nada. Todas são integradas juntas com operações vetorizadas, ao invés de um Object
+    (com sua própria lista de forças e laço de passos) por partícula.
+    Entradas:
+        x(array)-> posições iniciais, formato (N, 2)
+        v(array)-> velocidades iniciais, formato (N, 2)
+    """
+    COLOR = [120, 160, 255]
+
+    def __init__(self, x: np.ndarray, v: np.ndarray):
+        """
+        Inicializa os atributos:
+            x,v,a(array)-> posições, velocidades e acelerações (float64, formato (N, 2))
+            screen(array)-> posições na tela onde cada partícula foi desenhada pela última vez (float32, formato (N, 2)),
+                usadas para apagá-las no próximo frame
+            drawn(array)-> quais partículas estão desenhadas na tela (bool, formato (N,))
+        """
+        self.x = np.array(x, dtype=np.float64).reshape(-1, 2)
+        self.v = np.array(v, dtype=np.float64).reshape(-1, 2)
+        self.a = np.zeros_like(self.x)
+
+        self.screen = np.zeros(self.x.shape, dtype=np.float32)
+        self.drawn = np.zeros(len(self.x), dtype=bool)
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def ring(cls, attractor: Object, radius: float, n: int, speed_factor: float = 1.0) -> 'Tracers':
+        """
+        Anel de `n` partículas em torno de `attractor`, com velocidade `speed_factor` vezes a velocidade de órbita circular.
+        """
+        theta = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        direction = np.column_stack([np.cos(theta), np.sin(theta)])
+        speed = speed_factor * np.sqrt(G * attractor.mass / radius)
+
+        x = attractor.x + radius * direction
+        v = attractor.v + speed * direction @ np.array([[0, 1], [-1, 0]]) # direção tangencial (anti-horária)
+
+        return cls(x, v)
+
+    @classmethod
+    def cloud(cls, center: np.array, spread: float, velocity: np.array, n: int, seed: int = 0) -> 'Tracers':
+        """
+        Nuvem gaussiana de `n` partículas em torno de `center`, com desvio padrão `spread`, todas com velocidade `velocity`.
+        """
+        rng = np.random.default_rng(seed)
+        x = np.asarray(center, dtype=float) + spread * rng.standard_normal((n, 2))
+        v = np.broadcast_to(np.asarray(velocity, dtype=float), (n, 2))
+
+        return cls(x, v)
+
+    @classmethod
+    def velocity_grid(cls, position: np.array, velocity: np.array, span: float, n_side: int) -> 'Tracers':
+        """
+        Grade de n_side x n_side partículas que partem todas de `position`, com velocidades espalhadas em um
+        quadrado de lado `span` em torno de `velocity`. Útil para comparar as órbitas vizinhas a uma condição inicial.
+        """
+        offsets = np.linspace(-span / 2, span / 2, n_side)
+        vx, vy = np.meshgrid(offsets, offsets)
+
+        x = np.broadcast_to(np.asarray(position, dtype=float), (n_side * n_side, 2))
+        v = np.asarray(velocity, dtype=float) + np.column_stack([vx.ravel(), vy.ravel()])
+
+        return cls(x, v)
+
+    def advance(self, dt: float, n_steps: int, sources_x: np.ndarray, sources_mass: np.ndarray, softening: float, field: Callable = gravity_field):
+        """
+        Avança todas as partículas por `n_steps` passos de velocity-verlet de tamanho dt, na gravidade dos corpos
+        massivos (considerados fixos durante esse intervalo). `field` calcula a gravidade e tem a mesma interface
+        de `gravity_field` (ex.: um backend paralelo do módulo parallel).
+        """
+        for i in range(n_steps):
+            self.v += 1/2 * dt * self.a
+            self.x += dt * self.v
+            field(self.x, sources_x, sources_mass, softening, out=self.a)
+            self.v += 1/2 * dt * self.a
+
 class TextUpdater:
     """
     Classe que armazena uma função e a posição do texto que deve aparecer na tela. Chamamos ela para atualizarmos os valores que são apresentados na tela.
@@ -67,6 +320,127 @@ class TextUpdater:
         self.update = update
         self.position = position
 
+class PotentialField:
+    """
+    Camada de fundo opcional colorida pelo potencial gravitacional (ou pela intensidade do campo) dos corpos massivos.
+
+    O campo é calculado com o NumPy em uma grade DOWNSCALE vezes mais grossa que a tela e depois ampliado.
+    Cada imagem pronta é guardada em cache pela posição e escala do viewport e pelas massas/posições dos
+    corpos, de forma que só é recalculada quando o viewport ou os corpos mudam, e não a cada frame.
+    Entrada:
+        mode(str)-> 'potential' para o potencial ou 'field' para a intensidade do campo
+    """
+    MODES = ('potential', 'field')
+
+    DOWNSCALE = 4
+    MAX_CACHED_TILES = 16
+
+    # Distâncias que definem os extremos fixos da escala de cores: o valor do campo de toda a massa a
+    # MIN_RADIUS dela recebe a cor mais forte e a MAX_RADIUS a mais fraca. Como não dependem do viewport,
+    # o mesmo valor tem sempre a mesma cor, mesmo depois de mover a câmera ou mudar o zoom
+    MIN_RADIUS = 10
+    MAX_RADIUS = 2000
+
+    # Cores dos extremos da escala (valores pequenos e grandes, em escala logarítmica).
+    # São escuras para que objetos, rastros e textos continuem visíveis por cima
+    LOW_COLOR = np.array([20, 20, 20])
+    HIGH_COLOR = np.array([110, 25, 25])
+
+    def __init__(self, mode: str = 'potential'):
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de campo desconhecido: {mode}")
+
+        self.mode = mode
+        self.tiles: OrderedDict[tuple, pygame.Surface] = OrderedDict()
+
+    def key(self, engine: 'Engine') -> tuple:
+        """
+        Chave do cache: tudo de que a imagem depende (viewport, corpos massivos e suavização).
+        """
+        sources = tuple((o.mass, *o.x) for o in engine.massive_objects)
+        return (self.mode, *engine.viewport_center, engine.viewport_scale, engine.softening, sources)
+
+    def tile(self, engine: 'Engine') -> pygame.Surface:
+        """
+        Retorna a imagem do campo para o viewport atual da engine, calculando-a apenas se não estiver no cache.
+        """
+        key = self.key(engine)
+
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        tile = self.render(engine)
+
+        self.tiles[key] = tile
+        if len(self.tiles) > self.MAX_CACHED_TILES:
+            self.tiles.popitem(last=False) # remove a imagem usada há mais tempo
+
+        return tile
+
+    def bounds(self, engine: 'Engine') -> tuple[float, float]:
+        """
+        Extremos (log10) da escala de cores: o potencial (ou campo) de toda a massa dos corpos massivos
+        a MAX_RADIUS e a MIN_RADIUS de distância.
+        """
+        mu = G * max(sum(o.mass for o in engine.massive_objects), 1e-300)
+        power = 1 if self.mode == 'potential' else 2
+
+        def value(radius):
+            d = np.sqrt(radius ** 2 + engine.softening ** 2)
+            return np.log10(mu / d ** power)
+
+        return value(self.MAX_RADIUS), value(self.MIN_RADIUS)
+
+    def render(self, engine: 'Engine') -> pygame.Surface:
+        """
+        Calcula o campo na grade grossa e o converte em uma imagem do tamanho da tela.
+        """
+        w, h = engine.surface_size
+        cols, rows = max(1, w // self.DOWNSCALE), max(1, h // self.DOWNSCALE)
+
+        # Centros das células da grade, convertidos do sistema do pygame para o canônico
+        px = (np.arange(cols) + 1/2) * w / cols
+        py = (np.arange(rows) + 1/2) * h / rows
+        gx = engine.viewport_center[0] + (px - w / 2) / engine.viewport_scale
+        gy = engine.viewport_center[1] - (py - h / 2) / engine.viewport_scale
+        X, Y = np.meshgrid(gx, gy, indexing='ij') # formato (cols, rows), como espera o surfarray
+
+        # Só é calculado o que o modo usa: o potencial ou as duas componentes do campo
+        if self.mode == 'potential':
+            potential = np.zeros_like(X)
+        else:
+            field_x = np.zeros_like(X)
+            field_y = np.zeros_like(X)
+
+        for source in engine.massive_objects:
+            dx = X - source.x[0]
+            dy = Y - source.x[1]
+            d2 = dx * dx + dy * dy + engine.softening ** 2
+
+            if self.mode == 'potential':
+                potential -= G * source.mass / np.sqrt(d2)
+            else:
+                inverse_d3 = G * source.mass / (d2 * np.sqrt(d2))
+                field_x -= dx * inverse_d3
+                field_y -= dy * inverse_d3
+
+        if self.mode == 'potential':
+            value = np.abs(potential)
+        else:
+            value = np.hypot(field_x, field_y)
+
+        # Escala logarítmica normalizada pelos extremos fixos (ver MIN_RADIUS e MAX_RADIUS)
+        low, high = self.bounds(engine)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (np.log10(value) - low) / (high - low)
+        t = np.clip(np.nan_to_num(t, nan=1.0, posinf=1.0, neginf=0.0), 0, 1)
+
+        colors = self.LOW_COLOR + t[..., None] * (self.HIGH_COLOR - self.LOW_COLOR)
+
+        coarse = pygame.surfarray.make_surface(colors.astype(np.uint8))
+        return pygame.transform.smoothscale(coarse, (int(w), int(h)))
+
 class Engine:
     """
     Engine: É a classe responsável por controlar a taxa de quadros, configuração da tela da simulação, 
@@ -78,9 +452,30 @@ class Engine:
     FOREGROUND_COLOR = [255] * 3
 
     DELTA = 1e-5
+    SUBSTEPS = 1000
+
+    # Comprimento de suavização de Plummer. Com 0 a gravidade é a newtoniana exata
+    SOFTENING = 0
+
+    # Abaixo dessa distância ao atrator, o objeto é integrado com a regularização de Levi-Civita,
+    # em REGULARIZED_SUBSTEPS passos grandes por frame ao invés de SUBSTEPS passos de tamanho DELTA
+    REGULARIZATION_RADIUS = 40
+    REGULARIZED_SUBSTEPS = 10
 
     TRAIL_PERIOD = 30
     N_MAX_TRAILS = 50
+
+    # Passos de tempo em blocos: cada objeto usa um passo de (tempo do frame) / 2^level, com o nível escolhido
+    # pelo critério passo = BLOCK_ETA * |a| / |da/dt|, entre 0 e MAX_BLOCK_LEVEL
+    BLOCK_ETA = 0.002
+    MAX_BLOCK_LEVEL = 24
+
+    # Número de passos por frame das partículas traçadoras. Elas não precisam da mesma precisão dos objetos,
+    # então usamos passos bem maiores que DELTA
+    TRACER_SUBSTEPS = 20
+
+    # Limite de frames gravados por trajetória (1 hora de simulação a 60 frames por segundo)
+    MAX_RECORDED_FRAMES = 60 * 60 * 60
     
     def __init__(self, surface: pygame.Surface, font: pygame.font.Font):
         """
@@ -95,6 +490,8 @@ class Engine:
             trails->é usado para gerenciar as posições e características dos rastros que aparecem na tela. É um dicionário que armazena as posições(tuple) e o vetor unitário que indica a direção do movimento quando o ponto foi criado(np.array)
             ticks-> contador de ticks do sistema. Será incrementado a cada interação. Mede o número de ciclos ou passos da simulação.
             drag_start-> array de 2 posições(x,y). Guarda a posição inicial do cursor quando o usuário começa a arrastar o viewport
+            substeps-> número de passos de tamanho DELTA por frame, ou seja, o tempo simulado por frame é substeps * DELTA
+            realtime-> se False (exportação de vídeo), a engine não limita a taxa de quadros nem atualiza a janela
         """
         self.surface = surface
         self.font = font
@@ -108,10 +505,55 @@ class Engine:
         self.clock = pygame.time.Clock()
 
         self.objects: list[Object] = [] # lista de objetos que vão participar da simulação
+        self.tracers: list[Tracers] = [] # conjuntos de partículas traçadoras sem massa
+
+        # Função usada para calcular a gravidade sobre as partículas traçadoras. None usa `gravity_field`
+        # em uma única thread; pode ser trocada por um backend paralelo (ver o módulo parallel)
+        self.force_backend: Callable = None
         self.text_updaters: list[TextUpdater] = []
 
         self.pygame_coord_factor = np.array([1, -1])
 
+        self.softening = self.SOFTENING
+
+        # Camada de fundo com o campo gravitacional (PotentialField), desativada por padrão. Uma camada por
+        # modo é mantida em potential_fields, para que alternar entre eles não descarte as imagens em cache
+        self.potential_field: PotentialField = None
+        self.potential_fields: dict[str, PotentialField] = {}
+        self.background: pygame.Surface = None
+        self.background_key: tuple = None
+
+        self.substeps = self.SUBSTEPS
+        self.realtime = True
+
+        # Se True, os objetos usam passos de tempo em blocos (potências de 2) escolhidos individualmente,
+        # ao invés de substeps passos de tamanho DELTA
+        self.block_timesteps = False
+
+        # Se True, os passos de velocity-verlet atualizam os arrays dos objetos no lugar, sem alocar memória, e
+        # somam os incrementos de posição e velocidade (e do tempo) com a soma compensada de Kahan
+        self.high_precision = False
+        self.time_error = 0.0
+
+        # Áreas de trabalho do modo de alta precisão, alocadas uma única vez
+        self.increment = np.zeros(2)
+        self.kahan_scratch = np.zeros((2, 2))
+        self.gravity_scratch = np.zeros(2)
+
+        # Número de avaliações de força feitas (para comparar os esquemas de integração)
+        self.force_evaluations = 0
+
+        # Tempo simulado desde o último reset
+        self.time = 0.0
+
+        # Cache de trajetórias (opcional). Enquanto houver frames guardados para a configuração atual
+        # eles são reproduzidos; depois do fim deles a integração continua normalmente
+        self.trajectory_cache: TrajectoryCache = None
+        self.trajectory_key: str = None
+        self.replay: np.ndarray = None
+        self.recorded: list[np.ndarray] = []
+        self.frame = 0
+
         # Guarda as coordenadas de cada rastro, no sistema de coordenadas canônico, como chave
         # O valor corresponde ao versor velocidade do objeto que criou o rastro. Dessa forma,
         # o rastro pode ter sua escala ajustada de acordo com a escala do viewport
@@ -133,11 +575,15 @@ class Engine:
         self.reset_event_triggered = False
 
     def reset(self):
+        self.store_trajectory()  # Guarda a trajetória simulada até agora no cache
         self.objects.clear()  # Remove os objetos
+        self.tracers.clear()  # Remove as partículas traçadoras
         self.trails.clear()   # Limpa os rastros
         self.text_updaters.clear()  # Limpa os textos dinâmicos
         self.viewport_center = np.array([0, 0])  # Reseta o centro do viewport
         self.viewport_scale = 1  # Reseta o zoom
+        self.time = 0.0  # Reseta o tempo simulado
+        self.time_error = 0.0
         self.reset_event_triggered = False  # Garante que o evento de reset seja desmarcado
         self.redraw = True
 
@@ -149,6 +595,439 @@ class Engine:
         """
         self.objects.append(object)
 
+    def add_tracers(self, tracers: Tracers):
+        """
+        Adiciona um conjunto de partículas traçadoras, que sentem a gravidade dos corpos massivos mas não exercem força.
+        A aceleração inicial é calculada aqui, para que o primeiro passo de velocity-verlet já a use.
+        """
+        sources = self.massive_objects
+        field = self.force_backend or gravity_field
+        field(tracers.x, np.array([o.x for o in sources], dtype=float).reshape(-1, 2), np.array([o.mass for o in sources], dtype=float), self.softening, out=tracers.a)
+
+        self.tracers.append(tracers)
+
+    def integrate_tracers(self):
+        """
+        Avança todas as partículas traçadoras pelo tempo de um frame.
+        """
+        if not self.tracers:
+            return
+
+        sources = self.massive_objects
+        sources_x = np.array([o.x for o in sources], dtype=float).reshape(-1, 2)
+        sources_mass = np.array([o.mass for o in sources], dtype=float)
+
+        dt = self.substeps * self.DELTA / self.TRACER_SUBSTEPS
+        for tracers in self.tracers:
+            tracers.advance(dt, self.TRACER_SUBSTEPS, sources_x, sources_mass, self.softening, self.force_backend or gravity_field)
+
+    def draw_tracers(self, erase: bool = False) -> list[pygame.Rect]:
+        """
+        Desenha (ou apaga, restaurando o fundo) as partículas traçadoras diretamente nos pixels da tela.
+        Retorna os retângulos alterados.
+        """
+        rects = []
+        w, h = self.surface_size
+
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        background = pygame.surfarray.pixels3d(self.background) if erase and self.background else None
+
+        for tracers in self.tracers:
+            if erase:
+                cols, rows = tracers.screen[tracers.drawn].astype(np.intp).T
+                tracers.drawn[:] = False
+            else:
+                # Conversão vetorizada para o sistema de coordenadas do pygame (ver coordinate_to_pygame em step)
+                tracers.screen[:] = self.pygame_coord_factor * (self.viewport_scale * (tracers.x - self.viewport_center) + [1/2, -1/2] * self.surface_size)
+                tracers.drawn[:] = (tracers.screen[:, 0] >= 0) & (tracers.screen[:, 0] < w) & (tracers.screen[:, 1] >= 0) & (tracers.screen[:, 1] < h)
+                cols, rows = tracers.screen[tracers.drawn].astype(np.intp).T
+
+            if len(cols) == 0:
+                continue
+
+            if not erase:
+                pixels[cols, rows] = Tracers.COLOR
+            elif background is not None:
+                pixels[cols, rows] = background[cols, rows]
+            else:
+                pixels[cols, rows] = self.BACKGROUND_COLOR
+
+            rects.append(pygame.Rect(cols.min(), rows.min(), cols.max() - cols.min() + 1, rows.max() - rows.min() + 1))
+
+        # Libera as superfícies, que ficam travadas enquanto os arrays de pixels existem
+        del pixels, background
+
+        return rects
+
+    def integrator_settings(self) -> dict:
+        """
+        Parâmetros do integrador que, junto com a configuração inicial, determinam a trajetória.
+        """
+        return {
+            'delta': self.DELTA,
+            'substeps': self.substeps,
+            'softening': self.softening,
+            'regularization_radius': self.REGULARIZATION_RADIUS,
+            'regularized_substeps': self.REGULARIZED_SUBSTEPS,
+            'block_timesteps': self.block_timesteps and (self.BLOCK_ETA, self.MAX_BLOCK_LEVEL),
+            'high_precision': self.high_precision,
+        }
+
+    def start_trajectory(self, key: str):
+        """
+        Começa a gravar a trajetória da configuração identificada por `key` (ver TrajectoryCache.make_key).
+        Se o cache já tiver essa trajetória, ela será reproduzida a partir do próximo frame.
+        Deve ser chamado depois que todos os objetos foram adicionados.
+        """
+        self.trajectory_key = key
+        self.replay = self.trajectory_cache.get(key) if self.trajectory_cache else None
+        self.recorded = []
+        self.frame = 0
+
+    def store_trajectory(self):
+        """
+        Guarda no cache os frames reproduzidos e simulados desde o último `start_trajectory`.
+        """
+        if not self.trajectory_cache or not self.trajectory_key:
+            return
+
+        frames = list(self.replay[:self.frame]) if self.replay is not None else []
+        frames += self.recorded
+
+        if frames:
+            self.trajectory_cache.put(self.trajectory_key, np.array(frames))
+
+        self.trajectory_key = None
+        self.replay = None
+        self.recorded = []
+
+    def replay_frame(self) -> bool:
+        """
+        Se o frame atual estiver no cache, copia os estados guardados para os objetos.
+        Retorna se o frame foi reproduzido (e, portanto, não precisa ser integrado).
+        """
+        if self.replay is None or self.frame >= len(self.replay):
+            return False
+
+        # Cópia para dentro dos arrays dos objetos, que no modo de alta precisão são atualizados no lugar
+        for object, (x, v, a) in zip(self.objects, self.replay[self.frame]):
+            np.copyto(object.x, x)
+            np.copyto(object.v, v)
+            np.copyto(object.a, a)
+            object.x_error[:] = 0
+            object.v_error[:] = 0
+
+        return True
+
+    def record_frame(self):
+        """
+        Grava o estado dos objetos no frame atual, se ele ainda não estiver no cache.
+        """
+        if self.trajectory_key and (self.replay is None or self.frame >= len(self.replay)):
+            if self.frame < self.MAX_RECORDED_FRAMES:
+                self.recorded.append(np.array([[o.x, o.v, o.a] for o in self.objects], dtype=float))
+
+        self.frame += 1
+
+    def integrate_objects(self):
+        """
+        Avança todos os objetos pelo tempo de um frame (substeps * DELTA).
+        """
+        dt = self.substeps * self.DELTA
+        scheduled = []
+
+        for object in self.objects:
+            # se o objeto esta sob a ação de forças, atualizaremos sua nova posição, velocidade e aceleração.
+            if self.should_regularize(object):
+                # encontro próximo: passos grandes no tempo regularizado ao invés de reduzir o DELTA
+                self.regularized_step(object, dt)
+
+            elif object.forces or object.attractor:
+                if self.block_timesteps:
+                    scheduled.append(object)
+                else:
+                    self.integrate(object)
+
+        if scheduled:
+            self.block_step(scheduled, dt)
+
+    def verlet_step(self, object: Object, dt: float):
+        """
+        Um passo de tamanho dt do algoritmo velocity-verlet.
+        """
+        if self.high_precision:
+            self.compensated_verlet_step(object, dt)
+            return
+
+        v_prime = object.v + 1/2 * object.a * dt
+        new_x = object.x + v_prime * dt
+        new_a = self.acceleration(object, new_x)
+        new_v = v_prime + 1/2 * new_a * dt
+
+        object.x = new_x
+        object.v = new_v
+        object.a = new_a
+
+        self.force_evaluations += 1
+
+    def compensated_verlet_step(self, object: Object, dt: float):
+        """
+        O mesmo passo de `verlet_step`, mas atualizando x, v e a no lugar e somando os incrementos com `kahan_add`.
+        Sem forças extras (só o atrator), nenhuma memória é alocada.
+        """
+        increment = self.increment
+
+        np.multiply(object.a, 1/2 * dt, out=increment)
+        kahan_add(object.v, object.v_error, increment, self.kahan_scratch)
+
+        np.multiply(object.v, dt, out=increment)
+        kahan_add(object.x, object.x_error, increment, self.kahan_scratch)
+
+        self.acceleration_into(object, object.x, object.a)
+
+        np.multiply(object.a, 1/2 * dt, out=increment)
+        kahan_add(object.v, object.v_error, increment, self.kahan_scratch)
+
+        self.force_evaluations += 1
+
+    def integrate(self, object: Object):
+        """
+        Avança `object` pelo tempo de um frame com passos fixos de tamanho DELTA.
+        """
+        # o delta é pequeno (como deveria ser para obter uma boa derivada), então fazemos o calculo substeps vezes para
+        # traçar uma diferença de tempo significativa a cada passo.
+        for i in range(self.substeps):
+            # Aproximação usando o algoritmo velocity-verlet
+            self.verlet_step(object, self.DELTA)
+
+    def block_level(self, object: Object, a_old: np.array, dt: float, frame_dt: float) -> int:
+        """
+        Nível de passo desejado para `object`, pelo critério passo = BLOCK_ETA * |a| / |da/dt|, com a derivada
+        da aceleração (jerk) estimada pela diferença entre as acelerações antes e depois do último passo dt.
+        """
+        jerk = np.linalg.norm(object.a - a_old) / dt
+        if jerk == 0:
+            return 0
+
+        desired = self.BLOCK_ETA * np.linalg.norm(object.a) / jerk
+        if not np.isfinite(desired):
+            # estado inválido (ex.: NaN com o objeto sobre o atrator): não há o que resolver, mantém o nível
+            return object.level
+
+        if desired <= 0:
+            return self.MAX_BLOCK_LEVEL
+
+        return int(np.clip(np.ceil(np.log2(frame_dt / desired)), 0, self.MAX_BLOCK_LEVEL))
+
+    def block_step(self, objects: list[Object], frame_dt: float):
+        """
+        Avança `objects` pelo tempo de um frame com passos de tempo em blocos.
+
+        O frame é dividido em 2^MAX_BLOCK_LEVEL unidades de tempo inteiras e cada objeto anda com o passo do
+        seu nível, frame_dt / 2^level. A cada instante, apenas os objetos cujo próximo passo vence naquele
+        instante (o conjunto ativo) têm a força avaliada. Assim, objetos lentos dão poucos passos grandes
+        enquanto os rápidos dão muitos passos pequenos, sem que um force o passo de todos os outros.
+
+        Um objeto pode refinar o passo a qualquer momento, mas só pode dobrá-lo quando o seu tempo estiver
+        alinhado com o passo maior, mantendo todos sincronizados no fim do frame. A posição do atrator usada
+        é a atual dele, o que é exato quando ele não se move (como a estrela).
+        """
+        ticks = 1 << self.MAX_BLOCK_LEVEL
+        times = {}
+
+        for object in objects:
+            if object.level is None:
+                # Começamos com o passo mais próximo de DELTA, que sabemos ser seguro
+                object.level = int(np.clip(np.ceil(np.log2(frame_dt / self.DELTA)), 0, self.MAX_BLOCK_LEVEL))
+
+                # A aceleração começa em zero; sem calculá-la, o primeiro jerk estimado seria |a| / dt,
+                # o que jogaria o objeto para um nível muito fino
+                np.copyto(object.a, self.acceleration(object, object.x))
+            times[object] = 0
+
+        now = 0
+        while now < ticks:
+            for object in objects:
+                if times[object] != now:
+                    continue
+
+                step_ticks = ticks >> object.level
+                dt = frame_dt / (1 << object.level)
+
+                a_old = object.a.copy() # no modo de alta precisão, object.a é alterado no lugar
+                self.verlet_step(object, dt)
+                times[object] += step_ticks
+
+                level = self.block_level(object, a_old, dt, frame_dt)
+                if level > object.level:
+                    object.level = level
+                elif level < object.level and times[object] % (step_ticks << 1) == 0:
+                    object.level -= 1
+
+            now = min(times.values())
+
+    @property
+    def massive_objects(self) -> list[Object]:
+        """
+        Objetos que atraem gravitacionalmente algum outro objeto da simulação (ex.: a estrela).
+        """
+        return [o for o in self.objects if any(other.attractor is o for other in self.objects)]
+
+    def toggle_potential_field(self):
+        """
+        Alterna a camada de fundo entre desligada, potencial gravitacional e intensidade do campo.
+        """
+        modes = (None, *PotentialField.MODES)
+        current = self.potential_field.mode if self.potential_field else None
+        self.set_potential_field(modes[(modes.index(current) + 1) % len(modes)])
+
+    def set_potential_field(self, mode: str):
+        """
+        Liga a camada de fundo no modo `mode` (ver PotentialField.MODES), reaproveitando a camada já criada
+        para ele, ou a desliga se `mode` for None.
+        """
+        if mode is None:
+            self.potential_field = None
+        else:
+            if mode not in self.potential_fields:
+                self.potential_fields[mode] = PotentialField(mode)
+            self.potential_field = self.potential_fields[mode]
+
+        self.redraw = True
+
+    def draw_background(self):
+        """
+        Preenche a tela toda com o fundo: a cor de fundo ou, se ativada, a imagem do campo gravitacional.
+        """
+        if self.potential_field:
+            self.background = self.potential_field.tile(self)
+            self.background_key = self.potential_field.key(self)
+            self.surface.blit(self.background, (0, 0))
+        else:
+            self.background = None
+            self.background_key = None
+            self.surface.fill(self.BACKGROUND_COLOR)
+
+    def erase(self, rect: pygame.Rect):
+        """
+        Apaga a área `rect` da tela, restaurando o fundo por baixo dela.
+        """
+        if self.background:
+            return self.surface.blit(self.background, rect, rect)
+
+        return self.surface.fill(self.BACKGROUND_COLOR, rect)
+
+    def advance_time(self, dt: float):
+        """
+        Soma dt ao tempo simulado. No modo de alta precisão, a soma é compensada (Kahan), para que o tempo
+        continue exato depois de milhões de frames.
+        """
+        if not self.high_precision:
+            self.time += dt
+            return
+
+        y = dt - self.time_error
+        t = self.time + y
+        self.time_error = (t - self.time) - y
+        self.time = t
+
+    def present(self, rects: list = None):
+        """
+        Atualiza na janela as áreas `rects` (ou a tela toda, se None) e limita o programa a 60 frames por segundo.
+        Fora do tempo real (exportação) não há janela para atualizar nem motivo para esperar, então não faz nada.
+        """
+        if not self.realtime:
+            return
+
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+
+        self.clock.tick(60)
+
+    def gravity(self, object: Object, x: np.array) -> np.array:
+        """
+        Calcula a aceleração gravitacional que o atrator de `object` exerce nele na posição x,
+        suavizada pelo comprimento de Plummer `softening`.
+        Entradas:
+            object(Object)-> objeto atraído
+            x(array)-> posição do objeto
+        Saída:
+            array-> aceleração
+        """
+        r = x - object.attractor.x
+        return -G * object.attractor.mass * r / (r @ r + self.softening ** 2) ** 1.5
+
+    def acceleration(self, object: Object, x: np.array) -> np.array:
+        """
+        Calcula a aceleração total de `object` na posição x: a soma das forças dividida pela massa,
+        mais a gravidade do atrator (se houver).
+        """
+        a = sum(f(x) for f in object.forces) / object.mass
+
+        if object.attractor:
+            a = a + self.gravity(object, x)
+
+        return a
+
+    def acceleration_into(self, object: Object, x: np.array, out: np.array):
+        """
+        Versão de `acceleration` que escreve o resultado em `out`. A gravidade do atrator é calculada sem alocar
+        memória; as forças em `forces`, por serem funções arbitrárias, ainda criam arrays novos.
+        """
+        if object.attractor:
+            r = self.gravity_scratch
+            np.subtract(x, object.attractor.x, out=r)
+            np.multiply(r, -G * object.attractor.mass / (r @ r + self.softening ** 2) ** 1.5, out=out)
+        else:
+            out[:] = 0
+
+        for f in object.forces:
+            out += f(x) / object.mass
+
+    def should_regularize(self, object: Object) -> bool:
+        """
+        Verifica se `object` está em um encontro próximo com o seu atrator e deve ser integrado
+        com a regularização. Com suavização a força deixa de ser kepleriana, então não regularizamos.
+        Exatamente sobre o atrator (r = 0, ex.: posição inicial 0 0) a regularização não é definida, então
+        o objeto segue com o velocity-verlet, que apenas produz NaN, como antes da regularização.
+        """
+        if not object.attractor or self.softening:
+            return False
+
+        return 0 < np.linalg.norm(object.x - object.attractor.x) < self.REGULARIZATION_RADIUS
+
+    def regularized_step(self, object: Object, dt: float):
+        """
+        Avança `object` por um tempo dt durante um encontro próximo. O movimento em torno do atrator
+        é resolvido exatamente por `kepler_drift` e as demais forças do objeto entram como impulsos
+        (kick-drift-kick), o que permite passos grandes mesmo quando o objeto passa rente ao atrator.
+        Entradas:
+            object(Object)-> objeto a ser avançado
+            dt(float)-> intervalo de tempo
+        """
+        mu = G * object.attractor.mass
+        h = dt / self.REGULARIZED_SUBSTEPS
+
+        # Os arrays do objeto são atualizados no lugar, como no modo de alta precisão
+        for i in range(self.REGULARIZED_SUBSTEPS):
+            if object.forces:
+                object.v += 1/2 * h * sum(f(object.x) for f in object.forces) / object.mass
+
+            x, v = kepler_drift(object.x - object.attractor.x, object.v - object.attractor.v, mu, h)
+            np.add(object.attractor.x, x, out=object.x)
+            np.add(object.attractor.v, v, out=object.v)
+
+            if object.forces:
+                object.v += 1/2 * h * sum(f(object.x) for f in object.forces) / object.mass
+
+        np.copyto(object.a, self.acceleration(object, object.x))
+
+        # O estado foi recalculado por inteiro, então os erros acumulados até aqui não valem mais
+        object.x_error[:] = 0
+        object.v_error[:] = 0
+
     def step(self):
         """ Será responsável por:
         Atualização da física dos objetos.
@@ -208,7 +1087,7 @@ class Engine:
             """Responsável por redesenhar a tela quando necessário, ocorre após eventos que alteram a visualização como arrastar o viewport. 
             Ela limpa a tela preenchendo com a cor de fundo e depois redesenha os elementos.
             """
-            self.surface.fill(self.BACKGROUND_COLOR)
+            self.draw_background()
 
             for trail_coord, v_unit in self.trails.items():
                 """ Itera sobre todos os traços armazenados em trails e se ele não estiver na área de visualização ele ignora o rastro. 
@@ -233,6 +1112,8 @@ class Engine:
                 
                 if object.rect:
                     object.rect = pygame.draw.circle(self.surface, self.FOREGROUND_COLOR, new_coords, max(2, self.viewport_scale * object.radius))
+
+            self.draw_tracers()
                     
             # Parte que renderiza os textos dinamicamente na tela.
             for updater in self.text_updaters:
@@ -241,42 +1122,37 @@ class Engine:
                 rendered_rect = self.surface.blit(rendered_text, updater.position)
                 
             self.redraw = False
-            self.clock.tick(60)
-
-            pygame.display.update()
+            self.present()
             
             return
 
+        # Se os corpos massivos mudaram, a imagem do campo precisa ser refeita (redesenhando tudo no próximo step)
+        if self.potential_field and self.potential_field.key(self) != self.background_key:
+            self.redraw = True
+
         # isto gera uma lista de tuplas que guardam as coordenadas dos ultimos pontos de trail
         trail_coords = list(self.trails.keys())
 
+        # apaga as partículas traçadoras antes de desenhar os objetos, para não apagar pedaços deles
+        modified_rects += self.draw_tracers(erase=True)
+
+        # se o frame já estiver no cache de trajetórias, os estados são copiados dele e a física é pulada
+        replaying = self.replay_frame()
+
         # em cada step, a engine ira atualizar todos os objetos na seguinte parte:
-        for object in self.objects:
-            # se o objeto esta sob a ação de forças, atualizaremos sua nova posição, velocidade e aceleração.
-            if object.forces:
-                # o delta é pequeno (como deveria ser para obter uma boa derivada), então fazemos o calculo 1000 vezes para
-                # traçar uma diferença de tempo significativa a cada passo.
-                for i in range(1000):
-                    # Aproximação usando o algoritmo velocity-verlet
-                    v_prime = object.v + 1/2 * object.a * self.DELTA
-                    new_x = object.x + v_prime * self.DELTA
-                    F = sum(f(object.x) for f in object.forces)
-                    new_a = F / object.mass
-                    new_v = v_prime + 1/2 * new_a * self.DELTA
-
-                    object.x = new_x
-                    object.v = new_v
-                    object.a = new_a
+        if not replaying:
+            self.integrate_objects()
 
+        for object in self.objects:
             # Verificar se devemos desenhar mais um componente do rastro
             if object.trail and self.ticks % self.TRAIL_PERIOD == 0:
                 # Remove o primeiro componente do rastro a ser desenhado quando chegamos ao limite
                 if len(self.trails) == self.N_MAX_TRAILS:
                     first_trail_coord = next(iter(self.trails))
                     # pegamos o trail mais velho e retiramos ele do dict trails.
-                    self.trails.pop(first_trail_coord)
-                    # aqui, desenhamos a cor de background por cima do ponto que deve ser apagado
-                    trail_rect = pygame.draw.rect(self.surface, self.BACKGROUND_COLOR, [*coordinate_to_pygame(first_trail_coord, 1), 3, 3])
+                    first_v_unit = self.trails.pop(first_trail_coord)
+                    # aqui, restauramos o fundo por cima do ponto que deve ser apagado
+                    trail_rect = self.erase(pygame.Rect(*coordinate_to_pygame(first_trail_coord - 4 / self.viewport_scale * first_v_unit, 1), 3, 3))
                     modified_rects.append(trail_rect)
 
                 v_unit = object.v / np.linalg.norm(object.v) #versor velocidade
@@ -298,9 +1174,12 @@ class Engine:
 
                 old_rect = object.rect
                 modified_rects.append(old_rect)
-                # caso a bolinha já foi desenhada antes, ou seja, nao eh o primeiro frame, desenhar a bolinha antiga com a cor de fundo
+                # caso a bolinha já foi desenhada antes, ou seja, nao eh o primeiro frame, apagar a bolinha antiga
                 if old_rect:
-                    pygame.draw.circle(self.surface, self.BACKGROUND_COLOR, object.rect.center, max(2, self.viewport_scale * object.radius))
+                    if self.background:
+                        self.erase(old_rect)
+                    else:
+                        pygame.draw.circle(self.surface, self.BACKGROUND_COLOR, object.rect.center, max(2, self.viewport_scale * object.radius))
                 # agora desenha a nova posicao da bolinha (planeta) com a cor de destaque
                 object.rect = pygame.draw.circle(self.surface, self.FOREGROUND_COLOR, new_coords, max(2, self.viewport_scale * object.radius))
                 modified_rects.append(object.rect)
@@ -309,6 +1188,10 @@ class Engine:
             for trail_coord in trail_coords[:-1]:
                 if np.linalg.norm(object.x - trail_coord) <= object.radius:
                     self.trails.pop(trail_coord, None)
+
+        # as partículas traçadoras são integradas depois dos objetos, já que só dependem da posição dos corpos massivos
+        self.integrate_tracers()
+        modified_rects += self.draw_tracers()
                             
         #simples atualização dos textos das energias
         for updater in self.text_updaters:
@@ -318,12 +1201,12 @@ class Engine:
 
             modified_rects.append(rendered_rect)
         #as novas renderizações dos trails, planeta e texto das energias foram append no modified_rects
-        #e agora são atualizados no display do pygame
-        pygame.display.update(modified_rects)
-        # limitar o programa a 60 frames por segundo
-        self.clock.tick(60)
+        #e agora são atualizados no display do pygame, limitando o programa a 60 frames por segundo
+        self.present(modified_rects)
         # contador de atualizações da renderização
         self.ticks += 1
+        self.record_frame()
+        self.advance_time(self.substeps * self.DELTA)
 
     """ 
     entradas: update: uma função que apenas devolve o texto a ser colocado na tela durante a simulacao: energia e instruções
@@ -391,6 +1274,10 @@ class Engine:
                         self.surface.blit(darken_overlay, (0, 0))
                         pygame.display.update()
 
+                # pressionada a tecla c: alterna o fundo entre nada, potencial gravitacional e intensidade do campo
+                case pygame.KEYDOWN if event.key == pygame.K_c:
+                    self.toggle_potential_field()
+
                 # pressionada a tecla r: deve ser dado reset na simulacao, entao o evento de reset eh colocado como true
                 case pygame.KEYDOWN if event.key == pygame.K_r:
                     self.reset_event_triggered = True
@@ -0,0 +1,146 @@
+"""
+Exportação da simulação para vídeo ou sequência de imagens, sem janela e sem limite de taxa de quadros.
+
+    A engine é executada fora do tempo real (realtime False): cada frame avança um tempo simulado
+    fixo e a tela é copiada para uma fila limitada. Uma thread consumidora grava os frames enquanto
+    os próximos são renderizados, de modo que a codificação ocorre em paralelo com a renderização.
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import pygame
+
+from engine import Engine
+
+# Extensões que são gravadas como sequência de imagens (uma imagem por frame)
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.tga', '.jpg', '.jpeg', '.ppm')
+
+class FrameExporter:
+    """
+    Classe que conduz a engine fora do tempo real e grava cada frame renderizado.
+
+    O destino pode ser:
+    - um padrão de sequência de imagens com um campo numérico, ex.: "frames/%06d.png";
+    - um arquivo de vídeo (ex.: "orbita.mp4"), caso em que os frames crus (RGB) são enviados por um pipe
+      para o ffmpeg instalado na máquina.
+
+    Atributos:
+    - engine (Engine): Engine já configurada com os objetos da simulação.
+    - output (str): Destino dos frames.
+    - fps (int): Frames por segundo do vídeo gerado.
+    - queue_size (int): Número máximo de frames esperando para serem gravados.
+    """
+    def __init__(self, engine: Engine, output: str, fps: int = 60, sim_time_per_frame: float = None, queue_size: int = 16):
+        """
+        Parâmetros:
+            engine (Engine): Engine com os objetos da simulação.
+            output (str): Padrão da sequência de imagens ou arquivo de vídeo.
+            fps (int): Frames por segundo do vídeo (padrão: 60).
+            sim_time_per_frame (float): Tempo simulado por frame, em segundos. Se None, mantém o da engine.
+            queue_size (int): Tamanho da fila entre renderização e gravação (padrão: 16).
+        """
+        if fps <= 0:
+            raise ValueError("O número de frames por segundo deve ser positivo")
+        if sim_time_per_frame is not None and sim_time_per_frame <= 0:
+            raise ValueError("O tempo simulado por frame deve ser positivo")
+
+        self.engine = engine
+        self.output = output
+        self.fps = fps
+        self.queue_size = queue_size
+
+        if sim_time_per_frame is not None:
+            self.engine.substeps = max(1, round(sim_time_per_frame / self.engine.DELTA))
+
+        self.is_sequence = output.lower().endswith(IMAGE_EXTENSIONS)
+        if self.is_sequence and '%' not in output:
+            raise ValueError("O padrão da sequência de imagens deve conter um campo numérico, ex.: frames/%06d.png")
+
+    def run(self, n_frames: int):
+        """
+        Renderiza `n_frames` frames e os grava no destino.
+
+        A thread principal produz os frames (física + renderização) e os coloca em uma fila limitada;
+        a thread consumidora os grava. Quando a fila está cheia a renderização espera, o que limita a
+        memória usada caso a gravação seja mais lenta.
+        """
+        if n_frames <= 0:
+            raise ValueError("O número de frames exportados deve ser positivo")
+
+        self.engine.realtime = False
+        size = tuple(self.engine.surface_size)
+
+        frames = queue.Queue(maxsize=self.queue_size)
+        errors = []
+
+        if self.is_sequence:
+            directory = os.path.dirname(self.output)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            def write(index, data):
+                pygame.image.save(pygame.image.frombuffer(data, size, 'RGB'), self.output % index)
+
+            close = lambda: None
+        else:
+            encoder = self.open_encoder(size)
+
+            def write(index, data):
+                encoder.stdin.write(data)
+
+            def close():
+                encoder.stdin.close()
+                if encoder.wait() != 0:
+                    raise RuntimeError(f"O ffmpeg terminou com código {encoder.returncode}")
+
+        def consume():
+            """Grava os frames da fila até receber None. Em caso de erro, continua esvaziando a fila para não travar o produtor."""
+            while (item := frames.get()) is not None:
+                if errors:
+                    continue
+                try:
+                    write(*item)
+                except Exception as error:
+                    errors.append(error)
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+
+        try:
+            for index in range(n_frames):
+                if errors:
+                    break
+
+                self.engine.step()
+                # tobytes copia a tela, então o próximo frame pode ser renderizado enquanto este é gravado
+                frames.put((index, pygame.image.tobytes(self.engine.surface, 'RGB')))
+        finally:
+            frames.put(None)
+            consumer.join()
+            self.engine.realtime = True
+
+            try:
+                close()
+            except Exception as error:
+                errors.append(error)
+
+        if errors:
+            raise errors[0]
+
+    def open_encoder(self, size: tuple) -> subprocess.Popen:
+        """
+        Inicia o ffmpeg lendo frames RGB crus da entrada padrão e gravando o vídeo em `output`.
+        """
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg não encontrado. Instale-o ou exporte uma sequência de imagens (ex.: frames/%06d.png)")
+
+        return subprocess.Popen([
+            ffmpeg, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{size[0]}x{size[1]}', '-r', str(self.fps), '-i', '-',
+            '-pix_fmt', 'yuv420p', self.output
+        ], stdin=subprocess.PIPE)
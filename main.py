@@ -19,10 +19,16 @@ Nome do Projeto: Simulador de gravitacao Newtoniana
     da USP-São Carlos ministrada pela(o) [Prof. Krissia de Zawadzki/Esmerindo de Sousa Bernardes]
 """
 
+import os
+import argparse
+
 import pygame
 import numpy as np
 
-from engine import Engine, Object
+from engine import Engine, Object, PotentialField, Tracers, G
+from cache import TrajectoryCache
+from export import FrameExporter
+from parallel import make_backend
         
 class InputBox:
     """
@@ -182,6 +188,29 @@ class Sandbox:
         self.font = pygame.font.Font("assets/Terminus.ttf", 32)
         self.start_button = pygame.Rect(325, 510, 150, 50)
 
+    def collect_config(self):
+        """
+        Coleta e converte os valores das caixas de entrada.
+
+        Retorno:
+            Config (dicionário): Configurações iniciais da simulação, incluindo massas, posição e velocidade.
+
+        Exceções:
+            ValueError: Caso alguma caixa não contenha um número válido.
+        """
+        return {
+            'massa_estrela': float(self.input_massa_estrela.text) * 1e16,
+            'massa_planeta': float(self.input_massa_planeta.text),
+            'posicao_planeta': [
+                float(self.input_pos_x.text), 
+                float(self.input_pos_y.text)
+            ],
+            'velocidade_planeta': [
+                float(self.input_vel_x.text), 
+                float(self.input_vel_y.text)
+            ]
+        }
+
     def run(self):
         """
         Inicia o loop principal da classe que gerencia eventos e entradas do usuário.
@@ -237,37 +266,13 @@ class Sandbox:
                     if self.start_button.collidepoint(event.pos):
                         # Coletar e converter valores
                         try:
-                            config = {
-                                'massa_estrela': float(self.input_massa_estrela.text) * 1e16,
-                                'massa_planeta': float(self.input_massa_planeta.text),
-                                'posicao_planeta': [
-                                    float(self.input_pos_x.text), 
-                                    float(self.input_pos_y.text)
-                                ],
-                                'velocidade_planeta': [
-                                    float(self.input_vel_x.text), 
-                                    float(self.input_vel_y.text)
-                                ]
-                            }
-                            return config
+                            return self.collect_config()
                         except ValueError:
                             print("Valores inválidos. Por favor, insira números válidos.")
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         try:
-                            config = {
-                                'massa_estrela': float(self.input_massa_estrela.text) * 1e16,
-                                'massa_planeta': float(self.input_massa_planeta.text),
-                                'posicao_planeta': [
-                                    float(self.input_pos_x.text), 
-                                    float(self.input_pos_y.text)
-                                ],
-                                'velocidade_planeta': [
-                                    float(self.input_vel_x.text), 
-                                    float(self.input_vel_y.text)
-                                ]
-                            }
-                            return config
+                            return self.collect_config()
                         except ValueError:
                             print("Valores inválidos. Por favor, insira números válidos.")
 
@@ -280,8 +285,6 @@ class Sandbox:
         
         return None
 
-G = 6.6 * 10 ** -11
-
 # NOTE: as funções update_ke e update_pe sempre serão chamadas antes de update_e
 class EnergyUpdater:
     """
@@ -298,16 +301,18 @@ class EnergyUpdater:
     - pe (float): Energia potencial gravitacional do sistema.
     - e (float): Energia mecânica total do sistema.
     """
-    def __init__(self, planet: Object, star: Object):
+    def __init__(self, planet: Object, star: Object, softening: float = 0):
         """
         Inicializa um objeto da classe a partir dos objetos (estrela e planeta) da simulação.
 
         Parâmetros:
             planet (Object): O objeto que representa o planeta.
             star (Object): O objeto que representa a estrela.
+            softening (float): Comprimento de suavização de Plummer usado pela engine (padrão: 0).
         """
         self.planet = planet
         self.star = star
+        self.softening = softening
 
     # Energia cinética
     def update_ke(self):
@@ -330,14 +335,14 @@ class EnergyUpdater:
         Calcula e retorna a energia potencial gravitacional do sistema.
 
         A energia potencial é determinada pela fórmula:
-        PE = -(G * M * m) / r,
-        onde 'G' é a constante gravitacional, 'M' é a massa da estrela, 'm' é a massa do planeta
-        e 'r' é a distância entre eles.
+        PE = -(G * M * m) / sqrt(r^2 + eps^2),
+        onde 'G' é a constante gravitacional, 'M' é a massa da estrela, 'm' é a massa do planeta,
+        'r' é a distância entre eles e 'eps' é o comprimento de suavização (0 sem suavização).
 
         Retorno:
             str: Energia potencial formatada como uma string (para facilitar a exibição) no formato " V: <valor>".
         """
-        self.pe = -G * self.star.mass * self.planet.mass / np.linalg.norm(self.planet.x)
+        self.pe = -G * self.star.mass * self.planet.mass / np.sqrt(np.linalg.norm(self.planet.x) ** 2 + self.softening ** 2)
         return f" V: {' ' if self.pe >= 0 else ''}{self.pe:.2e}"
 
     # Energia mecânica
@@ -355,6 +360,43 @@ class EnergyUpdater:
         
         return f" E: {' ' if self.e >= 0 else ''}{self.e:.2e}"
 
+def parse_args():
+    """
+    Lê os argumentos da linha de comando. Sem argumentos, o programa abre a interface normalmente.
+
+    Com --export, a simulação é renderizada sem janela e gravada em um vídeo ou sequência de imagens,
+    usando as configurações padrão da Sandbox ou as passadas por argumento.
+    """
+    parser = argparse.ArgumentParser(description="orb: simulador de gravitação newtoniana")
+    parser.add_argument('--export', metavar='DESTINO', help="exporta a simulação para um vídeo (ex.: orbita.mp4, requer ffmpeg) ou sequência de imagens (ex.: frames/%%06d.png)")
+    parser.add_argument('--frames', type=int, default=600, help="número de frames exportados (padrão: 600)")
+    parser.add_argument('--fps', type=int, default=60, help="frames por segundo do vídeo exportado (padrão: 60)")
+    parser.add_argument('--sim-time', type=float, default=None, help="tempo simulado por frame exportado, em segundos (padrão: o da engine, 0.01). Valores maiores ficam lentos com passos fixos; combine com --passos-em-blocos")
+    parser.add_argument('--campo', choices=PotentialField.MODES, help="mostra no fundo o potencial gravitacional ou a intensidade do campo")
+    parser.add_argument('--tracers', choices=['anel', 'nuvem', 'grade'], help="adiciona partículas traçadoras sem massa: um anel em torno da estrela na distância do planeta, uma nuvem em torno do planeta ou uma grade de velocidades em torno da do planeta")
+    parser.add_argument('--n-tracers', type=int, default=2000, help="número de partículas traçadoras (padrão: 2000)")
+    parser.add_argument('--forcas', choices=['threads', 'processos', 'auto'], help="calcula a gravidade sobre as partículas traçadoras em paralelo, com threads, processos ou auto (threads, ou processos se as threads não escalarem nesta máquina)")
+    parser.add_argument('--workers', type=int, default=None, help="número de threads/processos do cálculo paralelo (padrão: todos os núcleos)")
+    parser.add_argument('--passos-em-blocos', action='store_true', help="integra cada corpo com o seu próprio passo de tempo (potências de 2), ao invés de um passo fixo para todos")
+    parser.add_argument('--alta-precisao', action='store_true', help="usa soma compensada nas posições, velocidades e no tempo, reduzindo o erro de arredondamento em simulações longas")
+    parser.add_argument('--cache-dir', metavar='DIRETORIO', help="diretório onde as trajetórias já simuladas são guardadas entre execuções")
+    parser.add_argument('--estrela', type=float, metavar='MASSA', help="massa da estrela (1e16 kg)")
+    parser.add_argument('--planeta', type=float, metavar='MASSA', help="massa do planeta (kg)")
+    parser.add_argument('--posicao', type=float, nargs=2, metavar=('X', 'Y'), help="posição inicial do planeta (m)")
+    parser.add_argument('--velocidade', type=float, nargs=2, metavar=('VX', 'VY'), help="velocidade inicial do planeta (m/s)")
+
+    args = parser.parse_args()
+
+    # Valores que o argparse aceita mas que não fazem sentido (e só falhariam depois, na exportação)
+    if args.frames <= 0:
+        parser.error("--frames deve ser positivo")
+    if args.fps <= 0:
+        parser.error("--fps deve ser positivo")
+    if args.sim_time is not None and args.sim_time <= 0:
+        parser.error("--sim-time deve ser positivo")
+
+    return args
+
 def main():
     """
     Função principal que gerencia a execução da simulação física.
@@ -371,13 +413,54 @@ def main():
     3. Gerencia o loop principal para atualizações de física, renderização e entrada do usuário.
     4. Permite reiniciar a simulação com novos parâmetros.
 
+    Com --export, as etapas 1, 3 e 4 são substituídas pela exportação sem janela ('FrameExporter').
+
     """
+    args = parse_args()
+
+    if args.export:
+        # Renderização sem janela
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
     screen = Sandbox()
-    config = screen.run()
+
+    if args.export:
+        # Valores passados por argumento substituem os padrões das caixas de entrada
+        overrides = [
+            (screen.input_massa_estrela, args.estrela),
+            (screen.input_massa_planeta, args.planeta),
+            (screen.input_pos_x, args.posicao and args.posicao[0]),
+            (screen.input_pos_y, args.posicao and args.posicao[1]),
+            (screen.input_vel_x, args.velocidade and args.velocidade[0]),
+            (screen.input_vel_y, args.velocidade and args.velocidade[1]),
+        ]
+        for box, value in overrides:
+            if value is not None:
+                box.text = str(value)
+
+        config = screen.collect_config()
+    else:
+        config = screen.run()
     
     if config:
         engine = Engine(screen.screen, screen.font)
 
+        if args.campo:
+            engine.set_potential_field(args.campo)
+
+        engine.block_timesteps = args.passos_em_blocos
+        engine.high_precision = args.alta_precisao
+
+        if args.forcas:
+            engine.force_backend = make_backend(args.forcas, args.workers)
+
+        # Trajetórias já simuladas são reproduzidas ao repetir uma configuração
+        engine.trajectory_cache = TrajectoryCache(directory=args.cache_dir)
+
+        if args.export:
+            # Criado antes dos objetos, pois define o tempo simulado por frame, que faz parte da chave do cache
+            exporter = FrameExporter(engine, args.export, args.fps, args.sim_time)
+
         def setup_objects(config):
             """
             Configura os objetos e textos no motor de simulação com base nas configurações fornecidas.
@@ -394,11 +477,13 @@ def main():
             star = Object(config['massa_estrela'], 12, trail=False)
             planet = Object(config['massa_planeta'], 5, trail=True)
 
-            planet.x = np.array(config['posicao_planeta'])
-            planet.v = np.array(config['velocidade_planeta'])
+            # Copiados para os arrays float64 já alocados pelo Object
+            np.copyto(planet.x, config['posicao_planeta'])
+            np.copyto(planet.v, config['velocidade_planeta'])
 
-            #Adiciona as forças gravitacionais ao planeta
-            planet.add_force(lambda r: -G * config['massa_estrela'] * config['massa_planeta'] * r / np.linalg.norm(r) ** 3)
+            #Adiciona a estrela como atratora do planeta. A gravidade é calculada pela engine, que
+            #suaviza a força (se configurado) e regulariza as passagens rentes à estrela
+            planet.set_attractor(star)
 
             engine.reset()  # Limpa a engine
 
@@ -406,17 +491,32 @@ def main():
             engine.add_object(star)
             engine.add_object(planet)
 
-            energy_updater = EnergyUpdater(planet, star)
+            engine.start_trajectory(TrajectoryCache.make_key(config, engine.integrator_settings()))
+
+            #Partículas traçadoras, criadas a partir das condições iniciais do planeta
+            if args.tracers == 'anel':
+                engine.add_tracers(Tracers.ring(star, np.linalg.norm(planet.x - star.x), args.n_tracers))
+            elif args.tracers == 'nuvem':
+                engine.add_tracers(Tracers.cloud(planet.x, 20, planet.v, args.n_tracers))
+            elif args.tracers == 'grade':
+                span = np.linalg.norm(planet.v) / 2
+                engine.add_tracers(Tracers.velocity_grid(planet.x, planet.v, span, max(1, int(np.sqrt(args.n_tracers)))))
+
+            energy_updater = EnergyUpdater(planet, star, engine.softening)
 
             #Adiciona atualizadores de texto para monitorar energias e informações do viewport
             engine.add_text_with_updater(energy_updater.update_ke, np.array([10, 500]))
             engine.add_text_with_updater(energy_updater.update_pe, np.array([10, 530]))
             engine.add_text_with_updater(energy_updater.update_e, np.array([10, 560]))
 
+            # Mostra o tempo simulado
+            engine.add_text_with_updater(lambda: f"t: {engine.time:.2f} s", np.array([10, 40]))
+
             # Mostra a posição do viewport
             engine.add_text_with_updater(lambda: f"({engine.viewport_center[0]:.3g}, {engine.viewport_center[1]:.3g})", np.array([10, 10]))
 
             # Mostra key/mouse binds
+            engine.add_text_with_updater(lambda: "     c: mostrar campo", np.array([450, 470]))
             engine.add_text_with_updater(lambda: " ctrl +/-: mudar zoom", np.array([450, 500]))
             engine.add_text_with_updater(lambda: "r: reset, esc: pausar", np.array([450, 530]))
             engine.add_text_with_updater(lambda: "  mouse: mover câmera", np.array([450, 560]))
@@ -424,15 +524,24 @@ def main():
         # Configura a engine inicialmente
         setup_objects(config)
 
-        while not engine.done:
-            engine.step()
-            engine.process_events()
-            
-            if engine.reset_event_triggered:
-                # Recoleta os dados de configuração
-                new_config = screen.run()
-                if new_config:
-                    setup_objects(new_config)  # Reconfigura a engine
+        if args.export:
+            exporter.run(args.frames)
+        else:
+            while not engine.done:
+                engine.step()
+                engine.process_events()
+                
+                if engine.reset_event_triggered:
+                    # Recoleta os dados de configuração
+                    new_config = screen.run()
+                    if new_config:
+                        setup_objects(new_config)  # Reconfigura a engine
+
+        engine.store_trajectory()
+        engine.trajectory_cache.flush()
+
+        if engine.force_backend:
+            engine.force_backend.close()
 
 if __name__ == "__main__":
     main()
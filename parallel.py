@@ -0,0 +1,226 @@
+"""
+Backends paralelos para o cálculo da gravidade dos corpos massivos sobre muitos pontos (ex.: partículas traçadoras).
+
+    Os pontos são divididos em um bloco por trabalhador (respeitando um tamanho mínimo, abaixo do qual o
+    custo de distribuir o trabalho passa do ganho) e cada bloco é calculado por `gravity_field` em um
+    trabalhador. Como a aceleração de cada ponto depende só dele e dos corpos massivos (somados sempre na
+    mesma ordem), o resultado é idêntico bit a bit ao do cálculo serial, qualquer que seja o número de
+    trabalhadores.
+"""
+
+import os
+import math
+import time
+import multiprocessing
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from engine import gravity_field
+
+def chunks(n: int, workers: int, min_chunk_size: int) -> list[tuple[int, int]]:
+    """
+    Divide os índices [0, n) em até `workers` blocos contíguos [start, stop) de pelo menos `min_chunk_size` pontos.
+    """
+    size = max(min_chunk_size, math.ceil(n / workers))
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+class ThreadForceBackend:
+    """
+    Calcula os blocos em um pool de threads persistente. As operações do NumPy sobre arrays grandes liberam
+    o GIL, então as threads rodam de fato em paralelo, sem copiar os dados.
+
+    Atributos:
+    - workers (int): Número de threads.
+    - min_chunk_size (int): Número mínimo de pontos por bloco.
+    """
+    MIN_CHUNK_SIZE = 512
+
+    def __init__(self, workers: int = None, min_chunk_size: int = None):
+        self.workers = workers or os.cpu_count()
+        self.min_chunk_size = min_chunk_size or self.MIN_CHUNK_SIZE
+        self.pool = ThreadPoolExecutor(self.workers)
+
+    def __call__(self, x: np.ndarray, sources_x: np.ndarray, sources_mass: np.ndarray, softening: float, out: np.ndarray = None) -> np.ndarray:
+        """
+        Mesma interface de `gravity_field`.
+        """
+        if out is None:
+            out = np.empty_like(x)
+
+        blocks = chunks(len(x), self.workers, self.min_chunk_size)
+        if len(blocks) <= 1:
+            return gravity_field(x, sources_x, sources_mass, softening, out=out)
+
+        tasks = [
+            self.pool.submit(gravity_field, x[start:stop], sources_x, sources_mass, softening, out[start:stop])
+            for start, stop in blocks
+        ]
+        for task in tasks:
+            task.result()
+
+        return out
+
+    def close(self):
+        self.pool.shutdown()
+
+# Memórias compartilhadas abertas em cada processo trabalhador, pelo nome. Só as da chamada atual são
+# mantidas: as antigas (já descartadas pelo processo principal ao crescer) são fechadas ao aparecerem novas
+_attached: dict[str, shared_memory.SharedMemory] = {}
+
+def _attach(names: tuple[str, ...], shape: tuple) -> list[np.ndarray]:
+    for name in list(_attached):
+        if name not in names:
+            _attached.pop(name).close()
+
+    for name in names:
+        if name not in _attached:
+            _attached[name] = shared_memory.SharedMemory(name=name)
+
+    return [np.ndarray(shape, dtype=np.float64, buffer=_attached[name].buf) for name in names]
+
+def _ready():
+    """
+    Tarefa vazia, usada para iniciar os processos trabalhadores.
+    """
+
+def _process_chunk(x_name: str, out_name: str, n: int, start: int, stop: int, sources_x: np.ndarray, sources_mass: np.ndarray, softening: float):
+    """
+    Executado nos processos trabalhadores: calcula o bloco [start, stop) lendo e escrevendo na memória compartilhada.
+    """
+    x, out = _attach((x_name, out_name), (n, 2))
+    gravity_field(x[start:stop], sources_x, sources_mass, softening, out=out[start:stop])
+
+class ProcessForceBackend:
+    """
+    Alternativa ao `ThreadForceBackend` para quando as threads não escalam: os blocos são calculados em um
+    pool de processos persistente. As posições e os resultados ficam em memória compartilhada, de forma que
+    só os poucos corpos massivos e os limites dos blocos são enviados a cada chamada.
+
+    Os processos são criados por um servidor (forkserver, ou spawn onde ele não existe) e todos já no
+    construtor: um fork do processo principal com outras threads rodando (ex.: a gravação da exportação)
+    poderia herdar travas presas.
+
+    Atributos:
+    - workers (int): Número de processos.
+    - min_chunk_size (int): Número mínimo de pontos por bloco.
+    """
+    MIN_CHUNK_SIZE = 1024
+
+    def __init__(self, workers: int = None, min_chunk_size: int = None):
+        self.workers = workers or os.cpu_count()
+        self.min_chunk_size = min_chunk_size or self.MIN_CHUNK_SIZE
+
+        # Os trabalhadores importam a engine (e o pygame); não repete a mensagem de boas-vindas em cada um
+        os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+        for task in [self.pool.submit(_ready) for _ in range(self.workers)]:
+            task.result()
+
+        self.capacity = 0
+        self.x_memory: shared_memory.SharedMemory = None
+        self.out_memory: shared_memory.SharedMemory = None
+
+    def reserve(self, n: int):
+        """
+        Garante memória compartilhada para n pontos. Ao crescer, cria blocos novos (com nomes novos, que os
+        trabalhadores abrem na primeira vez que os veem, fechando os antigos).
+        """
+        if n <= self.capacity:
+            return
+
+        capacity = max(n, 2 * self.capacity)
+        self.release()
+        self.capacity = capacity
+        self.x_memory = shared_memory.SharedMemory(create=True, size=self.capacity * 2 * 8)
+        self.out_memory = shared_memory.SharedMemory(create=True, size=self.capacity * 2 * 8)
+
+    def __call__(self, x: np.ndarray, sources_x: np.ndarray, sources_mass: np.ndarray, softening: float, out: np.ndarray = None) -> np.ndarray:
+        """
+        Mesma interface de `gravity_field`.
+        """
+        if out is None:
+            out = np.empty_like(x)
+
+        n = len(x)
+        blocks = chunks(n, self.workers, self.min_chunk_size)
+        if len(blocks) <= 1:
+            return gravity_field(x, sources_x, sources_mass, softening, out=out)
+
+        self.reserve(n)
+        shared_x = np.ndarray((n, 2), dtype=np.float64, buffer=self.x_memory.buf)
+        shared_out = np.ndarray((n, 2), dtype=np.float64, buffer=self.out_memory.buf)
+        shared_x[:] = x
+
+        sources_x = np.ascontiguousarray(sources_x, dtype=np.float64)
+        sources_mass = np.ascontiguousarray(sources_mass, dtype=np.float64)
+
+        tasks = [
+            self.pool.submit(_process_chunk, self.x_memory.name, self.out_memory.name, n, start, stop, sources_x, sources_mass, softening)
+            for start, stop in blocks
+        ]
+        for task in tasks:
+            task.result()
+
+        out[:] = shared_out
+        return out
+
+    def release(self):
+        for memory in (self.x_memory, self.out_memory):
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+
+        self.x_memory = self.out_memory = None
+        self.capacity = 0
+
+    def close(self):
+        self.pool.shutdown()
+        self.release()
+
+# Tamanho do problema de teste e eficiência mínima (speedup / threads) para o modo 'auto' manter as threads
+PROBE_SIZE = 65536
+MIN_THREAD_EFFICIENCY = 0.5
+
+def threads_scale(backend: ThreadForceBackend) -> bool:
+    """
+    Mede o speedup das threads sobre o cálculo serial em um problema de teste e diz se ele é aceitável.
+    """
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1000, 1000, (PROBE_SIZE, 2))
+    sources_x = rng.uniform(-100, 100, (4, 2))
+    sources_mass = rng.uniform(1e15, 1e16, 4)
+    out = np.empty_like(x)
+
+    def best_time(field):
+        times = []
+        for i in range(3):
+            start = time.perf_counter()
+            field(x, sources_x, sources_mass, 0.0, out=out)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    speedup = best_time(gravity_field) / best_time(backend)
+    return speedup >= MIN_THREAD_EFFICIENCY * backend.workers
+
+def make_backend(kind: str, workers: int = None):
+    """
+    Cria um backend de força pelo nome: 'threads', 'processos' ou 'auto' (threads, caindo para processos
+    quando as threads não escalam nesta máquina).
+    """
+    if kind == 'threads':
+        return ThreadForceBackend(workers)
+    if kind == 'processos':
+        return ProcessForceBackend(workers)
+    if kind == 'auto':
+        backend = ThreadForceBackend(workers)
+        if backend.workers == 1 or threads_scale(backend):
+            return backend
+
+        backend.close()
+        return ProcessForceBackend(workers)
+
+    raise ValueError(f"Backend de força desconhecido: {kind}")